@@ -1,4 +1,260 @@
-from utils import classproperty, extract_classes
+import collections
+import threading
+
+from utils import (ClassPropertyDescriptor, classproperty, extract_classes,
+        iter_batches, resolve_type_path, type_path)
+
+
+# Guards the creation of the per-class locks which, in turn, guard each
+# class's schema resolution.  See `DStruct.get_struct_schema`.
+_struct_schema_lock_guard = threading.Lock()
+
+
+def _get_struct_schema_lock(clazz):
+    """
+
+    :returns: The lock guarding the schema of this DStruct class (and only
+    this class), creating it if needed.
+
+    """
+
+    lock = clazz.__dict__.get("_struct_schema_lock")
+    if lock is None:
+        with _struct_schema_lock_guard:
+            lock = clazz.__dict__.get("_struct_schema_lock")
+            if lock is None:
+                lock = threading.RLock()
+                clazz._struct_schema_lock = lock
+
+    return lock
+
+
+def _is_bookkeeping_key(key):
+    """
+
+    :returns: Boolean.  True for the `_struct_`-prefixed attributes DStruct
+    keeps for itself.  Keys aren't always strings (think of
+    `DStruct({1: "one"})`), so anything else is just data.
+
+    """
+
+    return isinstance(key, basestring) and key.startswith("_struct_")
+
+
+def _encode_patch_value(value):
+    """
+
+    Turn DStruct values into plain data for `DStruct.diff`'s patches, as
+    `{"__dstruct__": "module.ClassName", "data": {...}}`.  DStructs inside
+    lists, tuples, dictionaries or other DStructs are encoded the same way;
+    anything else is left as it is.
+
+    """
+
+    if isinstance(value, DStruct):
+        return {
+                "__dstruct__": type_path(value.__class__),
+                "data": _encode_patch_value(value.get_struct_data()),
+                }
+
+    if isinstance(value, list):
+        return [_encode_patch_value(item) for item in value]
+
+    if isinstance(value, tuple):
+        return tuple(_encode_patch_value(item) for item in value)
+
+    if isinstance(value, dict):
+        return dict((key, _encode_patch_value(item))
+                for key, item in value.items())
+
+    return value
+
+
+def _decode_patch_value(value):
+    """
+
+    Undo `_encode_patch_value`, rebuilding DStructs through their
+    constructors.
+
+    Patches may come from elsewhere, so only DStruct subclasses are ever
+    built: the class is looked up among the ones defined so far, never
+    imported or called just because a patch names it.
+
+    :raises ValueError: if the patch names anything but a DStruct class.
+
+    """
+
+    if isinstance(value, list):
+        return [_decode_patch_value(item) for item in value]
+
+    if isinstance(value, tuple):
+        return tuple(_decode_patch_value(item) for item in value)
+
+    if not isinstance(value, dict):
+        return value
+
+    if "__dstruct__" not in value:
+        return dict((key, _decode_patch_value(item))
+                for key, item in value.items())
+
+    path = value["__dstruct__"]
+    matches = [clazz for clazz in DStruct.find_struct_classes()
+            if type_path(clazz) == path]
+
+    # several local classes can share a path; the importable one wins:
+    if len(matches) > 1:
+        try:
+            imported = resolve_type_path(path)
+        except ValueError:
+            imported = None
+        matches = [clazz for clazz in matches if clazz is imported]
+
+    if len(matches) != 1:
+        raise ValueError(
+                "`{}` isn't the path of a DStruct class".format(path))
+
+    return matches[0](_decode_patch_value(value["data"]))
+
+
+def _patch_values_equal(old, new):
+    """
+
+    `old == new`, except that DStructs (which only compare by identity),
+    including ones inside lists, tuples and dictionaries, are compared by
+    their data.
+
+    """
+
+    if old is new:
+        return True
+
+    if isinstance(old, DStruct) or isinstance(new, DStruct):
+        return old.__class__ is new.__class__ and not DStruct.diff(old, new)
+
+    if isinstance(old, (list, tuple)) and type(old) is type(new):
+        return len(old) == len(new) and all(
+                _patch_values_equal(a, b) for a, b in zip(old, new))
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        return len(old) == len(new) and all(
+                key in new and _patch_values_equal(item, new[key])
+                for key, item in old.items())
+
+    return old == new
+
+
+def _build_many(clazz, records):
+    """
+
+    `clazz.build_many(records)`, as a module-level function, so it can be
+    pickled over to a process pool (bound classmethods can't be).
+
+    """
+
+    return clazz.build_many(records)
+
+
+def _reduce_struct_error(error):
+    """
+
+    `__reduce__` for the exceptions nested in DStruct.  Pickle can't find
+    nested classes by name on Python 2, so errors raised in a process pool
+    (see `DStruct.iter_validated`) couldn't make it back to the caller.
+
+    """
+
+    return (_rebuild_struct_error,
+            (error.__class__.__name__, error.args, error.__dict__))
+
+
+def _rebuild_struct_error(name, args, state):
+    """
+
+    Undo `_reduce_struct_error`.
+
+    """
+
+    clazz = getattr(DStruct, name)
+
+    error = clazz.__new__(clazz, *args)
+    error.args = args
+    error.__dict__.update(state)
+
+    return error
+
+
+def _check_struct_version(clazz, version):
+    """
+
+    Make sure a stored record's schema version is an integer.  Something like
+    "1" (say, from JSON) would otherwise be compared with integers, which
+    Python 2 happily does, and fail in confusing ways.
+
+    :raises ValueError: if it isn't.
+
+    """
+
+    if type(version) not in (int, long):
+        raise ValueError(
+                "A {}'s schema version must be an integer, not {!r}".format(
+                    clazz.__name__, version))
+
+
+def _find_in_mro(clazz, name):
+    """
+
+    :returns: Whatever `clazz` would find for `name` by looking through its
+    MRO, without binding it (so functions come back as plain functions).
+
+    """
+
+    for base in clazz.__mro__:
+        if name in base.__dict__:
+            return base.__dict__[name]
+
+
+def _make_profiled_access(clazz):
+    """
+
+    Build the `__getattribute__` and `__getitem__` which
+    `DStruct.start_access_profile` installs on a class while its field
+    accesses are being profiled.  They record each read, then defer to the
+    implementations the class had before, so profiling doesn't change what
+    reads return.
+
+    :returns: Tuple of `(getattribute, getitem)` functions.
+
+    """
+
+    # if a base class is being profiled too, wrap what it had before, so reads
+    # aren't counted twice:
+    getattribute = _find_in_mro(clazz, "__getattribute__")
+    getattribute = getattr(getattribute, "_struct_wrapped", getattribute)
+    getitem = _find_in_mro(clazz, "__getitem__")
+    getitem = getattr(getitem, "_struct_wrapped", getitem)
+
+    def profiled_getattribute(self, name):
+        if name in object.__getattribute__(self, "__dict__"):
+            profile = type(self)._struct_access_profile
+            if profile is not None:
+                profile.record_read(type(self), name)
+
+        return getattribute(self, name)
+
+    def profiled_getitem(self, key):
+        value = getitem(self, key)
+
+        profile = type(self)._struct_access_profile
+        if profile is not None:
+            profile.record_read(type(self), key)
+
+        return value
+
+    profiled_getattribute._struct_wrapped = getattribute
+    profiled_getitem._struct_wrapped = getitem
+
+    return profiled_getattribute, profiled_getitem
+
 
 class DStruct(object):
     """
@@ -107,6 +363,10 @@ class DStruct(object):
 
     """
 
+    # The `DStruct.AccessProfile` collecting field reads for this class, if
+    # any.  See `start_access_profile`.
+    _struct_access_profile = None
+
     @classproperty
     def struct_schema_check_on_init(cls):
         """
@@ -117,6 +377,66 @@ class DStruct(object):
         """
         return True
 
+    @classproperty
+    def struct_extra_keys(cls):
+        """
+
+        :returns: String.  What to do with input keys that aren't declared by
+        the schema (i.e. that are neither required attributes nor listed in
+        `struct_allowed_extra_keys`):
+
+        - "keep": load them onto the instance like any other key.
+        - "drop": quietly leave them out.
+        - "forbid": leave them out, and have `check_struct_schema` raise an
+          `UnexpectedAttribute` for each of them.
+
+        """
+        return "keep"
+
+    @classproperty
+    def struct_allowed_extra_keys(cls):
+        """
+
+        :returns: List of Strings.  Keys that are loaded even when
+        `struct_extra_keys` is "drop" or "forbid", without being required.
+
+        """
+        return []
+
+    @classproperty
+    def struct_schema_version(cls):
+        """
+
+        :returns: Integer, or None.  The current version of this class's
+        schema.  If it isn't None, stored records can carry the version they
+        were written with (under `struct_schema_version_key`), and the bulk
+        constructors (`build_many`, `iter_validated`) upgrade older ones with
+        the steps registered through `struct_migration`.
+
+        """
+        return None
+
+    @classproperty
+    def struct_schema_version_key(cls):
+        """
+
+        :returns: String.  The key holding a stored record's schema version.
+        See `struct_schema_version`.
+
+        """
+        return "schema_version"
+
+    @classproperty
+    def struct_schema_collect_errors(cls):
+        """
+
+        :returns: Boolean.  If True, the schema check made by `__init__`
+        gathers every violation and raises them together as a single
+        `SchemaErrors`, rather than raising the first one it finds.
+
+        """
+        return False
+
 
     def __init__(self, input_dict=None, **entries): 
         """
@@ -124,7 +444,8 @@ class DStruct(object):
         Load the provided inputs onto this object, then set the instance
         attribute `_struct_has_loaded` to True.  Optionally (if the class
         attribute `struct_schema_check_on_init` is True), end with a call to
-        `self.check_struct_schema()`.
+        `self.check_struct_schema()`, collecting errors if the class attribute
+        `struct_schema_collect_errors` is True.
 
         :param input_dict:  Dictionary.  Any number of key-value pairs to be
         loaded onto this instance.
@@ -142,17 +463,313 @@ class DStruct(object):
         # 2. Mark myself as having been loaded:
         self._struct_has_loaded = True
 
-        # 3. Optionally, end with a schema check:
+        # 3. If someone is profiling field access, tell them what we hold:
+        if self._struct_access_profile is not None:
+            self._struct_access_profile.record_load(self)
+
+        # 4. Optionally, end with a schema check:
         if self.__class__.struct_schema_check_on_init:
-            self.check_struct_schema()
+            if self.__class__.struct_schema_collect_errors:
+                self.check_struct_schema(collect_errors=True)
+            else:
+                self.check_struct_schema()
+
+    @classmethod
+    def build_many(cls, records):
+        """
+
+        Construct one instance per record.
+
+        If the class is versioned (see `struct_schema_version`), records from
+        older versions are upgraded first.
+
+        :param records: Iterable of dictionaries, each passed to `__init__`.
+
+        :returns: List of instances of this class.
+
+        """
+
+        if cls.struct_schema_version is None:
+            return [cls(record) for record in records]
+
+        upgrade = cls.upgrade_struct_inputs
+        return [cls(upgrade(record)) for record in records]
+
+    @classmethod
+    def upgrade_struct_inputs(cls, record):
+        """
+
+        Bring a stored record up to the class's current schema version.
+
+        :param record: Dictionary.  Its version is read from the key named by
+        `struct_schema_version_key`; records without one are taken to be
+        current already, and are returned as they are.
+
+        :returns: Dictionary.  The upgraded record, without the version key.
+        The input record itself is never modified.
+
+        :raises ValueError: if the version isn't an integer, or there's no way
+        to upgrade from it.
+
+        """
+
+        version_key = cls.struct_schema_version_key
+
+        version = record.get(version_key)
+        if version is None:
+            return record
+
+        if version == cls.struct_schema_version and \
+                type(version) in (int, long):
+            schema = cls.get_struct_schema()
+
+            # "drop" won't load the version key anyway, so don't copy:
+            if schema.extra_keys == "drop" and \
+                    version_key not in schema.declared_keys:
+                return record
+
+            record = dict(record)
+            del record[version_key]
+            return record
+
+        return cls.get_struct_upgrade(version)(record)
+
+    @classmethod
+    def struct_migration(cls, from_version):
+        """
+
+        Decorator registering a migration step, which upgrades a record from
+        `from_version` to the next version:
+
+            @Order.struct_migration(1)
+            def add_currency(record):
+                record["currency"] = "USD"
+                return record
+
+        A step gets a dictionary it is free to modify, and returns the
+        upgraded dictionary.  Steps are inherited by subclasses, which can
+        replace them.
+
+        :param from_version: Integer.
+
+        :returns: Function.  The decorator.
+
+        """
+
+        def register(migration):
+            with _get_struct_schema_lock(cls):
+                if "_struct_migrations" not in cls.__dict__:
+                    cls._struct_migrations = {}
+                cls._struct_migrations[from_version] = migration
+
+            # upgrades compiled from the old steps are now stale:
+            for clazz in cls.find_struct_classes():
+                with _get_struct_schema_lock(clazz):
+                    if "_struct_upgrades" in clazz.__dict__:
+                        del clazz._struct_upgrades
+
+            return migration
+
+        return register
+
+    @classmethod
+    def get_struct_migrations(cls):
+        """
+
+        :returns: Dictionary of every migration step this class has,
+        including inherited ones, keyed by the version each upgrades from.
+
+        """
+
+        migrations = {}
+
+        for clazz in reversed(cls.__mro__):
+            migrations.update(clazz.__dict__.get("_struct_migrations", {}))
+
+        return migrations
+
+    @classmethod
+    def get_struct_upgrade(cls, from_version):
+        """
+
+        Get the function which upgrades records from `from_version` to the
+        current version, compiling it on first use.  Each one is cached, so
+        the chain of steps is only worked out once per source version.
+
+        :param from_version: Integer.
+
+        :returns: Function.  See `upgrade_struct_inputs`.
+
+        :raises ValueError: if `from_version` isn't an integer, or there's no
+        way to upgrade from it.
+
+        """
+
+        # before the cache lookup, where True would pass for 1:
+        _check_struct_version(cls, from_version)
+
+        upgrades = cls.__dict__.get("_struct_upgrades")
+        if upgrades is not None:
+            upgrade = upgrades.get(from_version)
+            if upgrade is not None:
+                return upgrade
+
+        # like the schema, each upgrade is compiled once, under the class's
+        # own lock:
+        with _get_struct_schema_lock(cls):
+            upgrades = cls.__dict__.get("_struct_upgrades")
+            if upgrades is None:
+                upgrades = cls._struct_upgrades = {}
+
+            upgrade = upgrades.get(from_version)
+            if upgrade is None:
+                upgrade = cls.compile_struct_upgrade(from_version)
+                upgrades[from_version] = upgrade
+
+        return upgrade
+
+    @classmethod
+    def compile_struct_upgrade(cls, from_version):
+        """
+
+        Chain the migration steps from `from_version` to the current version
+        into a single function.  Most callers want the cached
+        `get_struct_upgrade` instead.
+
+        :param from_version: Integer.
+
+        :returns: Function.  See `upgrade_struct_inputs`.
+
+        :raises ValueError: if `from_version` isn't an integer, if a step is
+        missing, or if `from_version` is newer than the class.
+
+        """
+
+        current_version = cls.struct_schema_version
+        migrations = cls.get_struct_migrations()
+        steps = []
+
+        _check_struct_version(cls, from_version)
+
+        if from_version > current_version:
+            raise ValueError(
+                    "Can't downgrade a {} from version {} to {}".format(
+                        cls.__name__, from_version, current_version))
+
+        for version in range(from_version, current_version):
+            if version not in migrations:
+                raise ValueError(
+                        "There's no migration for a {} from version {}".format(
+                            cls.__name__, version))
+            steps.append(migrations[version])
+
+        version_key = cls.struct_schema_version_key
+
+        def upgrade(record):
+            # one copy, which the steps are then free to modify:
+            record = dict(record)
+            del record[version_key]
+
+            for step in steps:
+                record = step(record)
+
+            return record
+
+        return upgrade
+
+    @classmethod
+    def iter_validated(cls, records, batch_size=100, executor=None,
+            max_pending=2):
+        """
+
+        Construct (and so validate) instances from a stream of records, a
+        batch at a time.
+
+        Without an executor, the point is to bound how long any one step
+        takes, rather than to go fast: between two instances handed to the
+        caller, at most one batch of `batch_size` records is built, so a
+        cooperative scheduler gets control back regularly.
+
+        With an `executor`, batches are built on it while the caller consumes
+        the previous ones.  That only pipelines the work: whenever the oldest
+        batch isn't finished yet, the caller blocks on it until it is, so
+        this does *not* cap how long the caller can be kept waiting.  No more
+        than `max_pending` batches are ever in flight: once that many have
+        been handed to the executor, reading from `records` waits until the
+        oldest one has been consumed.
+
+        :param records: Iterable of dictionaries.
+
+        :param batch_size: Integer.  How many records to build per batch.
+
+        :param executor: Optional.  A thread pool with a
+        `concurrent.futures.Executor`-style `submit(fn, *args)` method
+        returning an object with a `result()` method.  A process pool works
+        too, as long as this class is defined at module level and the records
+        can be pickled.  Validation errors are picklable, so they come back
+        from a process pool too.
+
+        :param max_pending: Integer.  How many batches may be in flight on
+        the executor at once.
+
+        :returns: Generator of instances of this class, in record order.
+
+        """
+
+        batches = iter_batches(records, batch_size)
+
+        if executor is None:
+            for batch in batches:
+                for struct in cls.build_many(batch):
+                    yield struct
+            return
+
+        pending = collections.deque()
+
+        for batch in batches:
+            pending.append(executor.submit(_build_many, cls, batch))
+
+            if len(pending) >= max_pending:
+                for struct in pending.popleft().result():
+                    yield struct
+
+        while pending:
+            for struct in pending.popleft().result():
+                yield struct
 
     def load_struct_inputs(self, input_dict, **entries):
 
         if not input_dict:
             input_dict = {}
 
-        self.__dict__.update(input_dict)
-        self.__dict__.update(entries)
+        schema = self.__class__.get_struct_schema()
+
+        if schema.extra_keys == "keep":
+            self.__dict__.update(input_dict)
+            self.__dict__.update(entries)
+            return
+
+        # `dict.update` (above) also takes an iterable of pairs, but the
+        # lookups below need a mapping:
+        if not hasattr(input_dict, "keys"):
+            input_dict = dict(input_dict)
+
+        # only copy the keys the schema knows about, however wide the input.
+        # (Validation stays in `check_struct_schema`, which subclasses can
+        # override or defer; like this loop, it only visits declared keys.)
+        data = self.__dict__
+        for key in schema.declared_keys:
+            if key in entries:
+                data[key] = entries[key]
+            elif key in input_dict:
+                data[key] = input_dict[key]
+
+        if schema.extra_keys == "forbid":
+            unexpected = schema.declared_keys.union(input_dict, entries)
+            if len(unexpected) > len(schema.declared_keys):
+                # reported by `check_struct_schema`:
+                self._struct_unexpected_keys = sorted(
+                        unexpected.difference(schema.declared_keys))
 
     @classmethod
     def get_extra_allowed_types(cls, _type):
@@ -184,7 +801,7 @@ class DStruct(object):
 
 
 
-    def check_struct_schema(self, clazz=None):
+    def check_struct_schema(self, clazz=None, collect_errors=False):
         """
 
         Check this instance's properties against the class's requirements.
@@ -194,43 +811,279 @@ class DStruct(object):
         If a required attribute is present, but has an unacceptable type,
         raise a RequiredAttributeInvalid.
 
+        If the class forbids undeclared keys (see `struct_extra_keys`) and
+        the instance was constructed with some, raise an UnexpectedAttribute.
+
         :param clazz: Class.  From which class should we pull the schema?
         Defaults to the instance's class (i.e. `self.__class`), which would
         confirm all the required attributes in the inheritance tree.  This
         parameter is exposed so a subclasses can check the relevant schemas
         with more granularity, if desired.
 
+        :param collect_errors: Boolean.  If True, don't stop at the first
+        problem: check everything, then raise a single `SchemaErrors` holding
+        all of them.
+
         :returns:  None.
 
         """
 
+        if collect_errors:
+            errors = self.find_struct_schema_errors(clazz)
+            if errors:
+                raise DStruct.SchemaErrors(self, errors)
+            return
+
+        if not clazz:
+            clazz = self.__class__
+
+        data = self.__dict__
+
+        for key, allowed_types in clazz.get_struct_schema().checks:
+
+            # confirm I have something stored at this key
+            if key not in data:
+                raise DStruct.RequiredAttributeMissing(self, key)
+
+            # validate my value's type (if one is specified)
+            if allowed_types and not isinstance(data[key], allowed_types):
+                raise DStruct.RequiredAttributeInvalid(
+                        self, key, data[key], allowed_types[0])
+
+        # complain about keys that `load_struct_inputs` refused to load
+        if "_struct_unexpected_keys" in data:
+            raise DStruct.UnexpectedAttribute(
+                    self, data["_struct_unexpected_keys"][0])
+
+    def find_struct_schema_errors(self, clazz=None):
+        """
+
+        Like `check_struct_schema`, but instead of raising, return every
+        problem found in one pass.
+
+        :param clazz: Class.  See `check_struct_schema`.
+
+        :returns: List of `RequiredAttributeMissing`,
+        `RequiredAttributeInvalid` and `UnexpectedAttribute` instances (not
+        raised).  Empty if this instance satisfies the schema.
+
+        """
+
         if not clazz:
             clazz = self.__class__
 
-        # are there any required attributes?
-        if len(clazz.required_attributes) > 0:
-            # ...if so, confirm them all:
-            for key,required_type in clazz.required_attributes.items():
+        data = self.__dict__
+        errors = []
 
-                # confirm I have something stored at this key
-                if key not in self.__dict__:
-                    raise DStruct.RequiredAttributeMissing(self, key)
+        for key, allowed_types in clazz.get_struct_schema().checks:
+            if key not in data:
+                errors.append(DStruct.RequiredAttributeMissing(self, key))
+            elif allowed_types and not isinstance(data[key], allowed_types):
+                errors.append(DStruct.RequiredAttributeInvalid(
+                        self, key, data[key], allowed_types[0]))
 
-                # validate my value's type (if one is specified)
-                if required_type:
+        for key in data.get("_struct_unexpected_keys", ()):
+            errors.append(DStruct.UnexpectedAttribute(self, key))
 
-                    allowed_types = [required_type]
-                    allowed_types += clazz.get_extra_allowed_types(
-                            required_type)
-                
-                    if not [1 for allowed_type in allowed_types 
-                            if isinstance(self.__dict__[key], allowed_type)]:
-                        raise DStruct.RequiredAttributeInvalid(
-                                self, key, self.__dict__[key])
+        return errors
 
     def __getitem__(self, key):
         return self.__dict__[key]
 
+    def get_struct_data(self):
+        """
+
+        :returns: Dictionary.  The key-value pairs that were loaded onto this
+        instance, without DStruct's own bookkeeping attributes (the ones
+        prefixed with `_struct_`).
+
+        """
+
+        return dict((key, value) for key, value in self.__dict__.items()
+                if not _is_bookkeeping_key(key))
+
+    @staticmethod
+    def diff(a, b):
+        """
+
+        Compute a compact patch which turns the struct `a` into the struct `b`.
+
+        Values that are the very same object in both structs are skipped
+        without being compared, so subtrees shared between two versions of a
+        big nested struct cost nothing.  Nested DStructs are diffed
+        recursively; anything else is compared with `==` (with DStructs
+        inside lists, tuples and dictionaries compared by their data).
+
+        DStruct values in the patch, including ones inside lists, tuples and
+        dictionaries, are written as plain data, i.e.
+        `{"__dstruct__": "module.ClassName", "data": {...}}`, so a patch made
+        of serializable values can be serialized (e.g. with `json`) as it is.
+
+        The patch is a plain dictionary with up to three keys, each omitted
+        when empty:
+
+            {
+                "set": {key: new_value, ...},
+                "unset": [key, ...],
+                "nested": {key: nested_patch, ...},
+            }
+
+        An empty dictionary means there is no difference.
+
+        :param a: DStruct.  The old version.
+
+        :param b: DStruct.  The new version.
+
+        :returns: Dictionary.  A patch suitable for `DStruct.apply_patch`.
+
+        :raises TypeError: if `a` and `b` aren't of the same class.
+
+        """
+
+        patch = {}
+
+        if a.__class__ is not b.__class__:
+            raise TypeError("Can't diff a {} against a {}".format(
+                    a.__class__.__name__, b.__class__.__name__))
+
+        if a is b:
+            return patch
+
+        old = a.__dict__
+        new = b.__dict__
+
+        for key, new_value in new.items():
+            if _is_bookkeeping_key(key):
+                continue
+
+            if key not in old:
+                patch.setdefault("set", {})[key] = _encode_patch_value(
+                        new_value)
+                continue
+
+            old_value = old[key]
+
+            # shared subtree, nothing to do:
+            if old_value is new_value:
+                continue
+
+            if isinstance(old_value, DStruct) and isinstance(new_value,
+                    DStruct) and old_value.__class__ is new_value.__class__:
+                nested = DStruct.diff(old_value, new_value)
+                if nested:
+                    patch.setdefault("nested", {})[key] = nested
+            elif not _patch_values_equal(old_value, new_value):
+                patch.setdefault("set", {})[key] = _encode_patch_value(
+                        new_value)
+
+        for key in old:
+            if key not in new and not _is_bookkeeping_key(key):
+                patch.setdefault("unset", []).append(key)
+
+        return patch
+
+    @staticmethod
+    def apply_patch(s, patch):
+        """
+
+        Apply a patch produced by `DStruct.diff` to the struct `s`.
+
+        `s` is left untouched.  The result is a new instance of `s`'s class
+        which shares every unchanged value with `s`, so it goes through the
+        usual `__init__` (and schema check) of that class.
+
+        :param s: DStruct.  The struct to patch.
+
+        :param patch: Dictionary.  A patch, as returned by `DStruct.diff`.
+
+        :returns: DStruct.  The patched struct.
+
+        """
+
+        if not patch:
+            return s
+
+        data = s.get_struct_data()
+
+        for key in patch.get("unset", ()):
+            data.pop(key, None)
+
+        for key, value in patch.get("set", {}).items():
+            data[key] = _decode_patch_value(value)
+
+        for key, nested in patch.get("nested", {}).items():
+            data[key] = DStruct.apply_patch(data[key], nested)
+
+        return s.__class__(data)
+
+    @classmethod
+    def start_access_profile(cls, profile=None):
+        """
+
+        Start recording which fields of this class (and its subclasses) are
+        actually read, either as attributes or through `__getitem__`.
+
+        Profiling works by temporarily installing a recording
+        `__getattribute__` on the class, so attribute access costs nothing
+        extra when no profile is running.  While one is, reads still go
+        through whatever `__getattribute__` and `__getitem__` the class
+        inherits.
+
+        :param profile: DStruct.AccessProfile.  Where to record accesses.
+        Defaults to a fresh profile.
+
+        :returns: DStruct.AccessProfile.  Call `report()` on it once the
+        sampling window is over.
+
+        """
+
+        if profile is None:
+            profile = DStruct.AccessProfile()
+
+        if "_struct_access_profile" not in cls.__dict__ or \
+                cls._struct_access_profile is None:
+            cls._struct_original_access = (
+                    cls.__dict__.get("__getattribute__"),
+                    cls.__dict__.get("__getitem__"))
+            cls.__getattribute__, cls.__getitem__ = \
+                    _make_profiled_access(cls)
+
+        cls._struct_access_profile = profile
+        return profile
+
+    @classmethod
+    def stop_access_profile(cls):
+        """
+
+        Stop the profile started by `start_access_profile` on this class and
+        restore plain attribute access.
+
+        :returns: DStruct.AccessProfile, or None if no profile was running.
+
+        """
+
+        profile = cls.__dict__.get("_struct_access_profile")
+        if profile is None:
+            return None
+
+        original_getattribute, original_getitem = cls._struct_original_access
+        del cls._struct_original_access
+
+        del cls.__getattribute__
+        if original_getattribute is not None:
+            cls.__getattribute__ = original_getattribute
+
+        del cls.__getitem__
+        if original_getitem is not None:
+            cls.__getitem__ = original_getitem
+
+        if cls is DStruct:
+            cls._struct_access_profile = None
+        else:
+            del cls._struct_access_profile
+
+        return profile
+
     @classproperty
     def required_attributes(cls):
         """
@@ -244,6 +1097,33 @@ class DStruct(object):
 
         """
 
+        return dict(cls.get_struct_schema().required_attributes)
+
+    @classmethod
+    def find_required_attributes(cls):
+        """
+
+        Walk the inheritance tree looking for RequiredAttribute declarations
+        (or a class-level `required_attributes` dictionary, which takes
+        precedence).
+
+        This does the actual work behind `required_attributes`; most callers
+        want that cached classproperty instead.
+
+        :returns: Dictionary.  Same as `required_attributes`.
+
+        """
+
+        for clazz in cls.__mro__:
+            if "required_attributes" in clazz.__dict__:
+                declared = clazz.__dict__["required_attributes"]
+                break
+
+        if declared is not DStruct.__dict__["required_attributes"]:
+            if isinstance(declared, ClassPropertyDescriptor):
+                declared = declared.__get__(None, cls)
+            return dict(declared)
+
         required_attributes = {}
 
         for clazz in extract_classes(cls):
@@ -253,6 +1133,157 @@ class DStruct(object):
 
         return required_attributes
 
+    @classmethod
+    def resolve_struct_schema(cls):
+        """
+
+        Build this class's schema from scratch.  This is called at most once
+        per class by `get_struct_schema`.
+
+        :returns: DStruct.Schema.
+
+        """
+
+        required_attributes = cls.find_required_attributes()
+        checks = []
+
+        for key, required_type in required_attributes.items():
+            allowed_types = None
+
+            if required_type:
+                allowed_types = [required_type]
+                allowed_types += cls.get_extra_allowed_types(required_type)
+                allowed_types = tuple(allowed_types)
+
+            checks.append((key, allowed_types))
+
+        if cls.struct_extra_keys not in ("keep", "drop", "forbid"):
+            raise ValueError(
+                    "{}.struct_extra_keys must be 'keep', 'drop' or 'forbid', "
+                    "not {!r}".format(cls.__name__, cls.struct_extra_keys))
+
+        return DStruct.Schema(required_attributes, checks,
+                cls.struct_extra_keys, cls.struct_allowed_extra_keys)
+
+    @classmethod
+    def get_struct_schema(cls):
+        """
+
+        Get this class's schema, resolving it on first use.
+
+        Each class resolves its schema exactly once, under a lock of its own,
+        so threads constructing different classes never wait on each other,
+        and threads racing to construct the first instance of a class don't
+        duplicate the work.  Once resolved, the schema is read without any
+        locking at all.
+
+        :returns: DStruct.Schema.
+
+        """
+
+        schema = cls.__dict__.get("_struct_schema")
+        if schema is not None:
+            return schema
+
+        with _get_struct_schema_lock(cls):
+            schema = cls.__dict__.get("_struct_schema")
+            if schema is None:
+                schema = cls.resolve_struct_schema()
+                cls._struct_schema = schema
+
+        return schema
+
+    @classmethod
+    def find_struct_classes(cls):
+        """
+
+        Find this class and every subclass of it that has been defined so
+        far, anywhere below it in the inheritance tree.
+
+        :returns: List of classes, parents before their children.
+
+        """
+
+        found = [cls]
+        seen = set(found)
+
+        for clazz in found:
+            for subclass in clazz.__subclasses__():
+                if subclass not in seen:
+                    seen.add(subclass)
+                    found.append(subclass)
+
+        return found
+
+    @classmethod
+    def warm_all(cls):
+        """
+
+        Resolve the schema of this class and of every one of its subclasses
+        right now, so none of them pays for it when its first instance is
+        built.  Call `DStruct.warm_all()` once at startup, after your models
+        have been imported.
+
+        :returns: List of the classes that were warmed.
+
+        """
+
+        classes = cls.find_struct_classes()
+
+        for clazz in classes:
+            clazz.get_struct_schema()
+
+        return classes
+
+    @classmethod
+    def reset_struct_schema(cls):
+        """
+
+        Forget the cached schema (and compiled upgrades) of this class and all
+        of its subclasses.  Only needed if you change a class's schema after
+        it has been used.
+
+        :returns: None
+
+        """
+
+        if "_struct_schema" in cls.__dict__:
+            del cls._struct_schema
+
+        if "_struct_upgrades" in cls.__dict__:
+            del cls._struct_upgrades
+
+        for subclass in cls.__subclasses__():
+            subclass.reset_struct_schema()
+
+    class Schema(object):
+        """
+
+        The resolved schema of a DStruct class, as built by
+        `resolve_struct_schema`.
+
+        - `required_attributes`: Dictionary.  See `DStruct.required_attributes`.
+
+        - `checks`: List of `(key, allowed_types)` tuples, where
+          `allowed_types` is either None or a tuple of types suitable for
+          `isinstance`.
+
+        - `extra_keys`: String.  See `DStruct.struct_extra_keys`.
+
+        - `declared_keys`: Frozenset of the keys loaded when `extra_keys`
+          isn't "keep": the required attributes, plus
+          `DStruct.struct_allowed_extra_keys`.
+
+        """
+
+        def __init__(self, required_attributes, checks, extra_keys="keep",
+                allowed_extra_keys=()):
+            self.required_attributes = required_attributes
+            self.checks = checks
+            self.extra_keys = extra_keys
+            self.declared_keys = frozenset(required_attributes).union(
+                    allowed_extra_keys)
+
     class RequiredAttribute(object):
         """
 
@@ -269,6 +1300,90 @@ class DStruct(object):
             self.required_type = required_type
 
 
+    class AccessProfile(object):
+        """
+
+        Collects, per DStruct class, how many instances were loaded with each
+        field and how many times each field was read.  Use it through
+        `DStruct.start_access_profile()` to find fields that producers can
+        stop sending.
+
+        Counts are updated under a lock, so they stay exact when structs are
+        built and read from many threads (at some cost, but only while
+        profiling).
+
+        """
+
+        def __init__(self):
+            self.instance_counts = {}
+            self.load_counts = {}
+            self.read_counts = {}
+            self._lock = threading.Lock()
+
+        def record_load(self, struct_instance):
+            clazz = struct_instance.__class__
+            keys = [key for key in
+                    object.__getattribute__(struct_instance, "__dict__")
+                    if not _is_bookkeeping_key(key)]
+
+            with self._lock:
+                self.instance_counts[clazz] = \
+                        self.instance_counts.get(clazz, 0) + 1
+
+                loads = self.load_counts.setdefault(clazz, {})
+                for key in keys:
+                    loads[key] = loads.get(key, 0) + 1
+
+        def record_read(self, clazz, key):
+            if _is_bookkeeping_key(key):
+                return
+
+            with self._lock:
+                reads = self.read_counts.setdefault(clazz, {})
+                reads[key] = reads.get(key, 0) + 1
+
+        def report(self, rarely_read_ratio=0.1):
+            """
+
+            Summarize the profile.
+
+            :param rarely_read_ratio: Float.  A field counts as "rarely read"
+            when its total number of reads is lower than this fraction of the
+            number of instances it was loaded onto.  (Reads aren't tracked
+            per instance, so a field read many times on a few instances
+            doesn't count as rarely read.)
+
+            :returns: Dictionary, keyed by class.  Each value is a dictionary
+            with the keys "instances" (how many instances were loaded),
+            "never_read" and "rarely_read" (sorted lists of field names) and
+            "reads" (a dictionary of read counts per field).
+
+            """
+
+            report = {}
+
+            for clazz, loads in self.load_counts.items():
+                reads = self.read_counts.get(clazz, {})
+                never_read = []
+                rarely_read = []
+
+                for key, load_count in loads.items():
+                    read_count = reads.get(key, 0)
+                    if not read_count:
+                        never_read.append(key)
+                    elif read_count < load_count * rarely_read_ratio:
+                        rarely_read.append(key)
+
+                report[clazz] = {
+                        "instances": self.instance_counts.get(clazz, 0),
+                        "never_read": sorted(never_read),
+                        "rarely_read": sorted(rarely_read),
+                        "reads": dict(reads),
+                        }
+
+            return report
+
+
     class RequiredAttributeMissing(Exception):
         """
 
@@ -276,11 +1391,21 @@ class DStruct(object):
         instance with some attribute that has been designated as a required
         attribute.
 
+        The message is only formatted if somebody asks for it, so raising and
+        catching these in bulk stays cheap.
+
         """
+
+        __reduce__ = _reduce_struct_error
+
         def __init__(self, struct_instance, key):
-            msg = "You need an attribute called `{}` when making a {}".format(
-                    key, struct_instance.__class__.__name__)
-            super(self.__class__, self).__init__(msg)
+            super(DStruct.RequiredAttributeMissing, self).__init__(key)
+            self.struct_instance = struct_instance
+            self.key = key
+
+        def __str__(self):
+            return "You need an attribute called `{}` when making a {}".format(
+                    self.key, self.struct_instance.__class__.__name__)
 
 
     class RequiredAttributeInvalid(Exception): 
@@ -289,10 +1414,76 @@ class DStruct(object):
         This is raised by `DStruct.__init__` if you construct the instance
         with a required attribute that isn't an instance of the specified type. 
 
+        The message is only formatted if somebody asks for it, so raising and
+        catching these in bulk stays cheap.
+
         """
-        def __init__(self, struct_instance, key, value):
+
+        __reduce__ = _reduce_struct_error
+
+        def __init__(self, struct_instance, key, value, required_type=None):
+            super(DStruct.RequiredAttributeInvalid, self).__init__(key)
+            self.struct_instance = struct_instance
+            self.key = key
+            self.value = value
+            self._required_type = required_type
+
+        @property
+        def required_type(self):
+            if self._required_type is None:
+                return self.struct_instance.__class__.required_attributes.get(
+                        self.key)
+            return self._required_type
+
+        def __str__(self):
             msg = "The value of the attribute`{}` must be an instance of {}.".format(
-                    key, struct_instance.__class__.required_attributes[key])
+                    self.key, self.required_type)
             msg += "  Instead, I got: {}, which is a {}".format(
-                    value, type(value))
-            super(self.__class__, self).__init__(msg)
+                    self.value, type(self.value))
+            return msg
+
+
+    class UnexpectedAttribute(Exception):
+        """
+
+        This is raised by `DStruct.__init__` if the class's
+        `struct_extra_keys` is "forbid" and you construct the instance with a
+        key the schema doesn't declare.
+
+        """
+
+        __reduce__ = _reduce_struct_error
+
+        def __init__(self, struct_instance, key):
+            super(DStruct.UnexpectedAttribute, self).__init__(key)
+            self.struct_instance = struct_instance
+            self.key = key
+
+        def __str__(self):
+            return "A {} doesn't take an attribute called `{}`".format(
+                    self.struct_instance.__class__.__name__, self.key)
+
+
+    class SchemaErrors(Exception):
+        """
+
+        This is raised by `check_struct_schema` (and so by `DStruct.__init__`,
+        if the class attribute `struct_schema_collect_errors` is True) when
+        errors are being collected rather than raised one at a time.
+
+        Its `errors` attribute lists every `RequiredAttributeMissing`,
+        `RequiredAttributeInvalid` and `UnexpectedAttribute` found.
+
+        """
+
+        __reduce__ = _reduce_struct_error
+
+        def __init__(self, struct_instance, errors):
+            super(DStruct.SchemaErrors, self).__init__(errors)
+            self.struct_instance = struct_instance
+            self.errors = errors
+
+        def __str__(self):
+            return "{} schema error(s) when making a {}:\n  {}".format(
+                    len(self.errors), self.struct_instance.__class__.__name__,
+                    "\n  ".join(str(error) for error in self.errors))
@@ -0,0 +1,190 @@
+"""
+
+Rough benchmarks for DStruct.  These are not tests; run them with:
+
+    python -m dstruct.tests.benchmarks
+
+"""
+
+# Python standard library imports:
+import sys
+import threading
+import time
+
+# Our imports:
+from .. import DStruct
+
+
+def construction_throughput(thread_counts=(1, 2, 4, 8, 16, 32),
+        per_thread=20000):
+    """
+
+    Construct DStructs from pools of threads of increasing size, all starting
+    against a freshly declared class so the first-use schema resolution is
+    part of what gets measured.
+
+    :returns: List of `(thread_count, structs_per_second)` tuples.
+
+    """
+
+    results = []
+
+    for thread_count in thread_counts:
+
+        class Row(DStruct):
+            id = DStruct.RequiredAttribute(int)
+            name = DStruct.RequiredAttribute(str)
+            score = DStruct.RequiredAttribute(float)
+
+        start = threading.Event()
+
+        def build():
+            start.wait()
+            for i in range(per_thread):
+                Row(id=i, name="row", score=1.5, note=None)
+
+        threads = [threading.Thread(target=build)
+                for i in range(thread_count)]
+        for thread in threads:
+            thread.start()
+
+        began = time.time()
+        start.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - began
+
+        results.append((thread_count, thread_count * per_thread / elapsed))
+
+    return results
+
+
+def make_models(class_count=300, field_count=12, depth=4):
+    """
+
+    Declare a tree of DStruct subclasses: `class_count` inheritance chains,
+    each `depth` levels deep, the way a service's models might look.
+
+    :returns: Tuple of `(root, classes, inputs)`, where `classes` holds
+    every class below `root` and `inputs` a valid input dictionary for each.
+
+    """
+
+    root = type("ModelRoot", (DStruct,), {})
+    values = (0, "", 0.0)
+    classes = []
+    inputs = []
+
+    for i in range(class_count):
+        parent = root
+        data = {}
+        for level in range(depth):
+            attributes = {}
+            for j in range(field_count // depth):
+                key = "field_{}_{}".format(level, j)
+                value = values[j % 3]
+                attributes[key] = DStruct.RequiredAttribute(type(value))
+                data[key] = value
+            parent = type("Model{}Level{}".format(i, level), (parent,),
+                    attributes)
+            classes.append(parent)
+            inputs.append(dict(data))
+
+    return root, classes, inputs
+
+
+def cold_start(class_count=300):
+    """
+
+    Compare getting every class of a big model tree ready lazily (by the
+    first instance of each) with warming them all up front.
+
+    :returns: List of `(label, seconds)` tuples.
+
+    """
+
+    root, classes, inputs = make_models(class_count)
+
+    def reset():
+        root.reset_struct_schema()
+
+    def first_instances():
+        for clazz, data in zip(classes, inputs):
+            clazz(data)
+
+    def timed(fn):
+        began = time.time()
+        fn()
+        return time.time() - began
+
+    reset()
+    lazy = timed(first_instances)
+
+    reset()
+    warming = timed(root.warm_all)
+    warmed = timed(first_instances)
+
+    return [
+            ("first instance of each class", lazy),
+            ("warm_all()", warming),
+            ("first instance of each class, once warm", warmed),
+            ]
+
+
+def wide_rows(row_count=10000, column_count=200):
+    """
+
+    Load rows of `column_count` columns into structs that only declare six
+    of them, with `struct_extra_keys` set to "keep" and then "drop".
+
+    :returns: List of `(policy, seconds, bytes_retained_per_struct)` tuples.
+    Retained bytes count each struct's `__dict__` plus the values it holds,
+    i.e. what stays alive once the rows themselves are thrown away.
+
+    """
+
+    rows = [dict(("column_{}".format(j), "{}-{}".format(i, j))
+            for j in range(column_count)) for i in range(row_count)]
+    declared = ["column_{}".format(j) for j in range(0, column_count, 35)]
+
+    results = []
+
+    for policy in ("keep", "drop"):
+        attributes = dict((key, DStruct.RequiredAttribute(str))
+                for key in declared)
+        attributes["struct_extra_keys"] = policy
+        Row = type("Row", (DStruct,), attributes)
+
+        began = time.time()
+        structs = Row.build_many(rows)
+        elapsed = time.time() - began
+
+        retained = 0
+        for struct in structs:
+            retained += sys.getsizeof(struct.__dict__)
+            retained += sum(sys.getsizeof(value)
+                    for value in struct.__dict__.values())
+
+        results.append((policy, elapsed, retained // len(structs)))
+
+    return results
+
+
+def main():
+    print("construction throughput")
+    for thread_count, rate in construction_throughput():
+        print("  {:>2} threads: {:>10.0f} structs/s".format(
+                thread_count, rate))
+
+    print("wide rows (200 columns, 6 declared)")
+    for policy, seconds, retained in wide_rows():
+        print("  {:<5} {:>8.1f} ms  {:>8} bytes/struct".format(
+                policy, seconds * 1000, retained))
+
+    print("cold start")
+    for label, seconds in cold_start():
+        print("  {:<40} {:>8.1f} ms".format(label, seconds * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,26 @@
 # Python standard library imports:
+import json
+import pickle
 import random
+import threading
+import time
 
 # Our imports:
 from base_test_case import BaseTestCase
 from .. import DStruct
 
 
+class PickledEvent(DStruct):
+    """
+
+    Used by `test_iter_validated`.  It lives at module level so it can be
+    pickled, as it would be on its way to a process pool.
+
+    """
+
+    id = DStruct.RequiredAttribute(int)
+
+
 class DStructTestCase(BaseTestCase):
 
     def test_struct(self):
@@ -328,3 +343,616 @@ class DStructTestCase(BaseTestCase):
             anon = NonUser(
                     name="user_from_linked_in_ad_31351513_A13CB941FF22",
                     age="eighteen")
+
+    def test_diff_and_apply_patch(self):
+
+        class Address(DStruct):
+            city = DStruct.RequiredAttribute(str)
+
+        class Customer(DStruct):
+            name = DStruct.RequiredAttribute(str)
+            address = DStruct.RequiredAttribute(Address)
+
+        orders = [1, 2, 3]
+        old = Customer(name="Ada", address=Address(city="London"),
+                orders=orders, nickname="countess")
+
+        # identical structs produce an empty patch:
+        self.assert_equal(DStruct.diff(old, old), {})
+        self.assert_true(DStruct.apply_patch(old, {}) is old)
+
+        new = Customer(name="Ada", address=Address(city="Paris"),
+                orders=orders, email="ada@example.com")
+
+        patch = DStruct.diff(old, new)
+        self.assert_equal(patch, {
+            "set": {"email": "ada@example.com"},
+            "unset": ["nickname"],
+            "nested": {"address": {"set": {"city": "Paris"}}},
+            })
+
+        patched = DStruct.apply_patch(old, patch)
+        self.assert_true(isinstance(patched, Customer))
+        self.assert_equal(patched.address.city, "Paris")
+        self.assert_equal(patched.email, "ada@example.com")
+        self.assert_false("nickname" in patched.__dict__)
+        self.assert_equal(DStruct.diff(patched, new), {})
+
+        # unchanged values are shared, not copied:
+        self.assert_true(patched.orders is orders)
+
+        # the original is left alone:
+        self.assert_equal(old.address.city, "London")
+        self.assert_equal(old.nickname, "countess")
+
+        # patches carrying DStructs survive a round trip through json:
+        moved = Customer(name="Ada", address=Address(city="Paris"),
+                orders=orders, billing=Address(city="Turin"))
+        patch = json.loads(json.dumps(DStruct.diff(new, moved)))
+        self.assert_equal(patch["set"]["billing"], {
+            "__dstruct__": "{}.Address".format(__name__),
+            "data": {"city": "Turin"},
+            })
+
+        patched = DStruct.apply_patch(new, patch)
+        self.assert_true(isinstance(patched.billing, Address))
+        self.assert_equal(patched.billing.city, "Turin")
+        self.assert_equal(DStruct.diff(patched, moved), {})
+
+        # ...including ones replacing something that wasn't a DStruct:
+        class Lead(DStruct):
+            address = DStruct.RequiredAttribute()
+
+        homeless = Lead(address=None)
+        housed = Lead(address=Address(city="Paris"))
+        patch = json.loads(json.dumps(DStruct.diff(homeless, housed)))
+        self.assert_equal(
+                DStruct.apply_patch(homeless, patch).address.city, "Paris")
+
+        # ...and DStructs inside lists, tuples and dictionaries:
+        class Item(DStruct):
+            sku = DStruct.RequiredAttribute(str)
+
+        class Cart(DStruct):
+            pass
+
+        small = Cart(items=[Item(sku="a")], by_sku={"a": Item(sku="a")})
+        big = Cart(items=[Item(sku="a"), Item(sku="b")],
+                by_sku={"a": Item(sku="a")}, pair=(Item(sku="c"), 1))
+
+        patch = json.loads(json.dumps(DStruct.diff(small, big)))
+        self.assert_equal(sorted(patch["set"]), ["items", "pair"])
+
+        patched = DStruct.apply_patch(small, patch)
+        self.assert_equal([item.sku for item in patched.items], ["a", "b"])
+        self.assert_true(all(isinstance(item, Item)
+            for item in patched.items))
+        self.assert_equal(patched.pair[0].sku, "c")
+
+        # (json turns tuples into lists, so only compare without it:)
+        patched = DStruct.apply_patch(small, DStruct.diff(small, big))
+        self.assert_equal(DStruct.diff(patched, big), {})
+
+        # equal DStructs rebuilt inside containers aren't changes:
+        self.assert_equal(DStruct.diff(small,
+            Cart(items=[Item(sku="a")], by_sku={"a": Item(sku="a")})), {})
+
+        # patches only ever build DStruct classes:
+        for path in ("subprocess.Popen", "os.path.join", "__builtin__.dict",
+                "no.such.Thing"):
+            with self.assert_raises(ValueError):
+                DStruct.apply_patch(small,
+                        {"set": {"x": {"__dstruct__": path, "data": {}}}})
+
+        # keys don't have to be strings:
+        numbered = DStruct({1: "one", "two": 2})
+        self.assert_equal(numbered.get_struct_data(), {1: "one", "two": 2})
+        renumbered = DStruct({1: "uno", "two": 2})
+        patch = DStruct.diff(numbered, renumbered)
+        self.assert_equal(patch, {"set": {1: "uno"}})
+        self.assert_equal(DStruct.apply_patch(numbered, patch)[1], "uno")
+
+        # structs of different classes can't be diffed:
+        with self.assert_raises(TypeError):
+            DStruct.diff(old, Address(city="London"))
+
+    def test_access_profile(self):
+
+        class Page(DStruct):
+            title = DStruct.RequiredAttribute(str)
+
+        profile = Page.start_access_profile()
+        try:
+            for i in range(20):
+                page = Page(title="Home", body="...", footer="(c)", debug=i)
+                page.title
+                page["body"]
+                if i == 0:
+                    page.footer
+        finally:
+            self.assert_true(Page.stop_access_profile() is profile)
+
+        report = profile.report(rarely_read_ratio=0.5)[Page]
+        self.assert_equal(report["instances"], 20)
+        self.assert_equal(report["never_read"], ["debug"])
+        self.assert_equal(report["rarely_read"], ["footer"])
+        self.assert_equal(report["reads"]["title"], 20)
+        self.assert_equal(report["reads"]["body"], 20)
+
+        # once stopped, nothing more is recorded and access is plain again:
+        page = Page(title="Home", debug=1)
+        page.debug
+        self.assert_false("__getattribute__" in Page.__dict__)
+        self.assert_equal(profile.report()[Page]["instances"], 20)
+        self.assert_equal(profile.report()[Page]["never_read"], ["debug"])
+        self.assert_true(Page.stop_access_profile() is None)
+
+    def test_access_profile_with_non_string_keys(self):
+
+        class Context(DStruct):
+            pass
+
+        profile = Context.start_access_profile()
+        try:
+            context = Context({1: "one", "two": 2})
+            self.assert_equal(context[1], "one")
+            self.assert_equal(context.two, 2)
+        finally:
+            Context.stop_access_profile()
+
+        report = profile.report()[Context]
+        self.assert_equal(report["reads"], {1: 1, "two": 1})
+        self.assert_equal(report["never_read"], [])
+
+    def test_access_profile_keeps_inherited_access(self):
+
+        class Defaults(DStruct):
+            def __getitem__(self, key):
+                return self.__dict__.get(key, "default")
+
+            def __getattribute__(self, name):
+                if name == "shouting":
+                    return "HEY"
+                return super(Defaults, self).__getattribute__(name)
+
+        class Page(Defaults):
+            pass
+
+        class FrontPage(Page):
+            pass
+
+        page = FrontPage(title="Home")
+        self.assert_equal(page["missing"], "default")
+
+        profile = Page.start_access_profile()
+        # a subclass profiled at the same time doesn't count reads twice:
+        FrontPage.start_access_profile(profile)
+        try:
+            page = FrontPage(title="Home")
+            self.assert_equal(page["missing"], "default")
+            self.assert_equal(page["title"], "Home")
+            self.assert_equal(page.title, "Home")
+            self.assert_equal(page.shouting, "HEY")
+        finally:
+            FrontPage.stop_access_profile()
+            Page.stop_access_profile()
+
+        self.assert_equal(profile.report()[FrontPage]["reads"]["title"], 2)
+        self.assert_equal(page["missing"], "default")
+        self.assert_false("__getitem__" in Page.__dict__)
+
+    def test_schema_resolved_once_under_concurrency(self):
+
+        resolutions = []
+
+        class Reading(DStruct):
+            sensor = DStruct.RequiredAttribute(str)
+            value = DStruct.RequiredAttribute(float)
+
+            @classmethod
+            def resolve_struct_schema(cls):
+                resolutions.append(cls)
+                # widen the window in which other threads could race us:
+                time.sleep(0.01)
+                return super(Reading, cls).resolve_struct_schema()
+
+        errors = []
+        start = threading.Event()
+
+        def build():
+            start.wait()
+            try:
+                for i in range(50):
+                    Reading(sensor="t1", value=float(i))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=build) for i in range(16)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+
+        self.assert_equal(errors, [])
+        self.assert_equal(resolutions, [Reading])
+        self.assert_equal(Reading.required_attributes,
+                {"sensor": str, "value": float})
+
+        # subclasses get a schema of their own:
+        class CalibratedReading(Reading):
+            offset = DStruct.RequiredAttribute(float)
+
+        CalibratedReading(sensor="t1", value=1.0, offset=0.5)
+        self.assert_equal(resolutions, [Reading, CalibratedReading])
+        with self.assert_raises(DStruct.RequiredAttributeMissing):
+            CalibratedReading(sensor="t1", value=1.0)
+
+        # ...and a reset schema is resolved again:
+        Reading.reset_struct_schema()
+        Reading(sensor="t1", value=1.0)
+        CalibratedReading(sensor="t1", value=1.0, offset=0.5)
+        self.assert_equal(len(resolutions), 4)
+
+    def test_collect_errors(self):
+
+        class Row(DStruct):
+            struct_schema_collect_errors = True
+
+            id = DStruct.RequiredAttribute(int)
+            name = DStruct.RequiredAttribute(str)
+            email = DStruct.RequiredAttribute(str)
+
+        Row(id=1, name="Ada", email="ada@example.com")
+
+        with self.assert_raises(DStruct.SchemaErrors) as context:
+            Row(id="one", name="Ada")
+
+        errors = context.exception.errors
+        self.assert_equal(len(errors), 2)
+        by_key = dict((error.key, error) for error in errors)
+        self.assert_true(isinstance(by_key["email"],
+                DStruct.RequiredAttributeMissing))
+        self.assert_true(isinstance(by_key["id"],
+                DStruct.RequiredAttributeInvalid))
+        self.assert_equal(by_key["id"].value, "one")
+        self.assert_equal(by_key["id"].required_type, int)
+
+        message = str(context.exception)
+        self.assert_true("2 schema error(s) when making a Row" in message)
+        self.assert_true("`email`" in message)
+        self.assert_true("`id`" in message)
+
+        # the same checks are available without raising:
+        row = Row(id=1, name="Ada", email="ada@example.com")
+        self.assert_equal(row.find_struct_schema_errors(), [])
+        del row.email
+        self.assert_equal(
+                [error.key for error in row.find_struct_schema_errors()],
+                ["email"])
+
+        # ...and on demand, for classes that raise one error at a time:
+        class Point(DStruct):
+            x = DStruct.RequiredAttribute(int)
+            y = DStruct.RequiredAttribute(int)
+
+        with self.assert_raises(DStruct.RequiredAttributeMissing) as context:
+            Point()
+        self.assert_true("when making a Point" in str(context.exception))
+
+        point = Point(x=1, y=2)
+        point.x, point.y = 1.5, None
+        with self.assert_raises(DStruct.SchemaErrors) as context:
+            point.check_struct_schema(collect_errors=True)
+        self.assert_equal(len(context.exception.errors), 2)
+
+    def test_warm_all(self):
+
+        class Base(DStruct):
+            x = DStruct.RequiredAttribute(int)
+
+        class Child(Base):
+            y = DStruct.RequiredAttribute(int)
+
+        class GrandChild(Child):
+            pass
+
+        self.assert_equal(Base.find_struct_classes(), [Base, Child, GrandChild])
+        self.assert_true(Base in DStruct.find_struct_classes())
+
+        Base.warm_all()
+        for clazz in (Base, Child, GrandChild):
+            self.assert_true("_struct_schema" in clazz.__dict__)
+        self.assert_equal(GrandChild.required_attributes, {"x": int, "y": int})
+
+    def test_iter_validated(self):
+
+        class Event(DStruct):
+            id = DStruct.RequiredAttribute(int)
+
+        records = [{"id": i} for i in range(10)]
+
+        events = list(Event.iter_validated(records, batch_size=3))
+        self.assert_equal([event.id for event in events], range(10))
+        self.assert_true(all(isinstance(event, Event) for event in events))
+
+        self.assert_equal(Event.build_many([]), [])
+
+        # nothing is built until it's asked for, and then only a batch:
+        built = []
+
+        def source():
+            for record in records:
+                built.append(record)
+                yield record
+
+        events = Event.iter_validated(source(), batch_size=4)
+        next(events)
+        self.assert_equal(len(built), 4)
+
+        # with an executor, only `max_pending` batches are in flight:
+        class Future(object):
+            def __init__(self, fn, args):
+                self.fn, self.args = fn, args
+
+            def result(self):
+                executor.in_flight -= 1
+                return self.fn(*self.args)
+
+        class Executor(object):
+            in_flight = 0
+            most_in_flight = 0
+
+            def submit(self, fn, *args):
+                self.in_flight += 1
+                self.most_in_flight = max(self.most_in_flight,
+                        self.in_flight)
+                return Future(fn, args)
+
+        executor = Executor()
+        events = list(Event.iter_validated(records, batch_size=2,
+                executor=executor, max_pending=3))
+        self.assert_equal([event.id for event in events], range(10))
+        self.assert_equal(executor.most_in_flight, 3)
+        self.assert_equal(executor.in_flight, 0)
+
+        # what goes to and comes back from the executor can be pickled, for
+        # process pools:
+        class PickledFuture(object):
+            def __init__(self, fn, args):
+                self.fn, self.args = fn, args
+
+            def result(self):
+                try:
+                    result = self.fn(*self.args)
+                except Exception as e:
+                    raise pickle.loads(pickle.dumps(e))
+                return pickle.loads(pickle.dumps(result))
+
+        class PicklingExecutor(object):
+            def submit(self, fn, *args):
+                fn, args = pickle.loads(pickle.dumps((fn, args)))
+                return PickledFuture(fn, args)
+
+        events = list(PickledEvent.iter_validated(records, batch_size=4,
+                executor=PicklingExecutor()))
+        self.assert_equal([event.id for event in events], range(10))
+        self.assert_true(all(isinstance(event, PickledEvent)
+            for event in events))
+
+        with self.assert_raises(DStruct.RequiredAttributeInvalid) as context:
+            list(PickledEvent.iter_validated([{"id": 1}, {"id": "two"}],
+                executor=PicklingExecutor()))
+        self.assert_equal(context.exception.key, "id")
+        self.assert_equal(context.exception.value, "two")
+        self.assert_true("must be an instance of <type 'int'>" in
+                str(context.exception))
+
+        # the collected kind survives the trip too:
+        errors = DStruct.SchemaErrors(PickledEvent(id=1), [
+            DStruct.RequiredAttributeMissing(PickledEvent(id=1), "name"),
+            DStruct.UnexpectedAttribute(PickledEvent(id=1), "colour"),
+            ])
+        errors = pickle.loads(pickle.dumps(errors))
+        self.assert_equal([error.key for error in errors.errors],
+                ["name", "colour"])
+        self.assert_true("2 schema error(s) when making a PickledEvent" in
+                str(errors))
+
+        # invalid records still raise:
+        with self.assert_raises(DStruct.RequiredAttributeInvalid):
+            list(Event.iter_validated([{"id": 1}, {"id": "two"}]))
+
+    def test_extra_keys(self):
+
+        row = dict(("column_{}".format(i), i) for i in range(200))
+        row.update(id=7, name="widget")
+
+        class Kept(DStruct):
+            id = DStruct.RequiredAttribute(int)
+
+        self.assert_equal(len(Kept(row).get_struct_data()), 202)
+
+        class Dropped(DStruct):
+            struct_extra_keys = "drop"
+            struct_allowed_extra_keys = ["name", "missing_but_allowed"]
+
+            id = DStruct.RequiredAttribute(int)
+
+        dropped = Dropped(row, column_3="override")
+        self.assert_equal(dropped.get_struct_data(),
+                {"id": 7, "name": "widget"})
+
+        # like `dict.update`, an iterable of pairs works too:
+        dropped = Dropped(sorted(row.items()))
+        self.assert_equal(dropped.get_struct_data(),
+                {"id": 7, "name": "widget"})
+
+        # keyword arguments still win over the dictionary:
+        dropped = Dropped(row, id=8)
+        self.assert_equal(dropped.id, 8)
+
+        # declared keys are still validated:
+        with self.assert_raises(DStruct.RequiredAttributeMissing):
+            Dropped(name="widget")
+
+        class Forbidden(DStruct):
+            struct_extra_keys = "forbid"
+
+            id = DStruct.RequiredAttribute(int)
+
+        Forbidden(id=1)
+        Forbidden([("id", 1)])
+
+        with self.assert_raises(DStruct.UnexpectedAttribute) as context:
+            Forbidden(id=1, colour="red")
+        self.assert_equal(context.exception.key, "colour")
+        self.assert_true("doesn't take an attribute called `colour`" in
+                str(context.exception))
+
+        class CollectedForbidden(Forbidden):
+            struct_schema_collect_errors = True
+
+        with self.assert_raises(DStruct.SchemaErrors) as context:
+            CollectedForbidden(id="one", colour="red", size=2)
+        self.assert_equal(
+                sorted((type(error), error.key)
+                    for error in context.exception.errors),
+                sorted([(DStruct.RequiredAttributeInvalid, "id"),
+                    (DStruct.UnexpectedAttribute, "colour"),
+                    (DStruct.UnexpectedAttribute, "size")]))
+
+        class Confused(DStruct):
+            struct_extra_keys = "sometimes"
+
+        with self.assert_raises(ValueError):
+            Confused()
+
+    def test_schema_versions(self):
+
+        class Order(DStruct):
+            struct_schema_version = 3
+
+            id = DStruct.RequiredAttribute(int)
+            total_in_cents = DStruct.RequiredAttribute(int)
+            currency = DStruct.RequiredAttribute(str)
+
+        calls = []
+
+        @Order.struct_migration(1)
+        def rename_total(record):
+            calls.append(1)
+            record["total_in_cents"] = int(record.pop("total") * 100)
+            return record
+
+        @Order.struct_migration(2)
+        def add_currency(record):
+            calls.append(2)
+            record.setdefault("currency", "USD")
+            return record
+
+        v1 = {"schema_version": 1, "id": 1, "total": 19.77}
+        v2 = {"schema_version": 2, "id": 2, "total_in_cents": 500}
+        v3 = {"schema_version": 3, "id": 3, "total_in_cents": 1,
+                "currency": "EUR"}
+        unversioned = {"id": 4, "total_in_cents": 2, "currency": "GBP"}
+
+        orders = Order.build_many([v1, v2, v3, unversioned])
+        self.assert_equal(
+                [(o.id, o.total_in_cents, o.currency) for o in orders],
+                [(1, 1977, "USD"), (2, 500, "USD"), (3, 1, "EUR"),
+                    (4, 2, "GBP")])
+        self.assert_equal(calls, [1, 2, 2])
+        self.assert_false("schema_version" in orders[0].__dict__)
+
+        # the stored records are left alone:
+        self.assert_equal(v1, {"schema_version": 1, "id": 1, "total": 19.77})
+
+        # upgrades are compiled once per source version:
+        self.assert_true(Order.get_struct_upgrade(1) is
+                Order.get_struct_upgrade(1))
+        self.assert_equal(
+                [o.id for o in Order.iter_validated([v1, v1], batch_size=1)],
+                [1, 1])
+
+        # ...even when many threads ask for them at once:
+        compiled = []
+
+        class ConcurrentOrder(Order):
+            @classmethod
+            def compile_struct_upgrade(cls, from_version):
+                compiled.append(from_version)
+                time.sleep(0.01)
+                return super(ConcurrentOrder, cls).compile_struct_upgrade(
+                        from_version)
+
+        start = threading.Event()
+        upgrades = []
+
+        def upgrade(from_version):
+            start.wait()
+            upgrades.append(ConcurrentOrder.get_struct_upgrade(from_version))
+
+        threads = [threading.Thread(target=upgrade, args=(1 + i % 2,))
+                for i in range(16)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+
+        self.assert_equal(sorted(compiled), [1, 2])
+        self.assert_equal(len(set(upgrades)), 2)
+        self.assert_equal(sorted(ConcurrentOrder._struct_upgrades), [1, 2])
+
+        # ...and recompiled when the steps change:
+        upgrade = Order.get_struct_upgrade(1)
+
+        @Order.struct_migration(2)
+        def add_euros(record):
+            record.setdefault("currency", "EUR")
+            return record
+
+        self.assert_false(Order.get_struct_upgrade(1) is upgrade)
+        self.assert_equal(Order.build_many([v2])[0].currency, "EUR")
+
+        # subclasses inherit the steps:
+        class SpecialOrder(Order):
+            pass
+
+        self.assert_equal(SpecialOrder.build_many([v1])[0].total_in_cents,
+                1977)
+
+        with self.assert_raises(ValueError):
+            Order.build_many([{"schema_version": 0, "id": 5}])
+
+        with self.assert_raises(ValueError):
+            Order.build_many([{"schema_version": 4, "id": 5}])
+
+        # versions must be integers, even when they look like one:
+        with self.assert_raises(ValueError) as context:
+            Order.build_many([{"schema_version": "1", "id": 5}])
+        self.assert_true("must be an integer" in str(context.exception))
+
+        with self.assert_raises(ValueError):
+            Order.build_many([{"schema_version": True, "id": 5}])
+
+        # current records are only copied to drop the version key...
+        self.assert_equal(Order.upgrade_struct_inputs(v3), {"id": 3,
+            "total_in_cents": 1, "currency": "EUR"})
+        self.assert_true("schema_version" in v3)
+
+        # ...which isn't needed when the class drops undeclared keys:
+        class DroppingOrder(Order):
+            struct_extra_keys = "drop"
+
+        self.assert_true(DroppingOrder.upgrade_struct_inputs(v3) is v3)
+        self.assert_false(
+                "schema_version" in DroppingOrder.build_many([v3])[0].__dict__)
+
+        # unversioned classes don't treat the version key specially:
+        class Plain(DStruct):
+            pass
+
+        plain = Plain.build_many([{"schema_version": 1}])[0]
+        self.assert_equal(plain.schema_version, 1)
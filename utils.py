@@ -1,4 +1,5 @@
 import string
+import sys
 
 
 def dedupe_list(input_list, preserve_order=True):
@@ -14,6 +15,29 @@ def dedupe_list(input_list, preserve_order=True):
     return [ x for x in input_list if x not in seen and not seen.add(x)]
 
 
+def iter_batches(iterable, batch_size):
+    """
+
+    Chop an iterable up into lists of (at most) `batch_size` items.
+
+    :param iterable: anything iterable, possibly endless
+    :param batch_size: int, how many items go in each list
+    :returns: generator of lists
+
+    """
+
+    batch = []
+
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
 def snake_to_mixed(underscore_input):
     """
     mixedCaseLooksLikeThis
@@ -50,6 +74,42 @@ def extract_classes(clazz):
         extracted.remove(object)
 
     return dedupe_list(extracted, preserve_order=True)
+
+
+def type_path(_type):
+    """
+
+    :param _type: type, the thing we need a name for
+
+    :returns: string, the dotted path of the type, e.g. "os.path.join"
+
+    """
+
+    return "{}.{}".format(_type.__module__, _type.__name__)
+
+
+def resolve_type_path(path):
+    """
+
+    Find the type named by a path made with `type_path`, among the modules
+    that have already been imported.  (Nothing gets imported as a side
+    effect.)
+
+    :param path: string, a dotted path
+
+    :returns: type
+
+    :raises ValueError: if there's nothing at that path
+
+    """
+
+    module_name, _, name = path.rpartition(".")
+
+    module = sys.modules.get(module_name)
+    if module is None or not hasattr(module, name):
+        raise ValueError("Can't find `{}`".format(path))
+
+    return getattr(module, name)
  
 
 # Decorate a method with @classproperty to make it behave like @property, but 